@@ -1,95 +1,324 @@
 import streamlit as st
-from openai import OpenAI
-import pandas as pd
+from diskcache import Cache
+from pydantic import BaseModel, Field, ValidationError
+import numpy as np
 import logging
+import hashlib
 import json
-import re
+import time
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-client = OpenAI(api_key=st.secrets["OPEN_AI_KEY"])
 
+# Cached factory for the OpenAI client; openai is only imported on the first API call and the
+# client, with its connection pool, is reused across reruns and sessions
+@st.cache_resource
+def get_client():
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["OPEN_AI_KEY"], timeout=30.0, max_retries=2)
 
-# Function to read JSON data from a file
-def read_file(path):
-    with open(path, 'r') as json_file:
-        data = json.load(json_file)
-    return data
+
+# Persistent response cache shared across restarts, keyed by the normalized disease name
+CACHE_DIR = './.cache/disease'
+CHAT_MODEL = "gpt-4o-mini"
+EMBEDDING_MODEL = "text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.92
+EMBEDDING_INDEX_KEY = '_embedding_index'
+BATCH_POLL_INTERVAL = 30  # seconds between Batch API status checks
+
+
+# Cached factory for the disk cache, so reruns reuse one open cache instead of reopening it
+@st.cache_resource
+def get_disease_cache():
+    return Cache(CACHE_DIR)
+
+
+disease_cache = get_disease_cache()
+
+
+# Models of the expected OpenAI response, mirroring disease_response_template.json
+class Statistics(BaseModel):
+    total_cases: float
+    recovery_rate: str = Field(description='Percentage, e.g. "50%"')
+    mortality_rate: str = Field(description='Percentage, e.g. "50%"')
+
+
+class Medication(BaseModel):
+    name: str
+    side_effects: list[str] = Field(description="Examples of side effects")
+    dosage: str = Field(description="Typical dosage")
+
+
+class DiseaseInfo(BaseModel):
+    name: str
+    statistics: Statistics
+    recovery_options: dict[str, str] = Field(description="Each recovery option mapped to a detailed explanation")
+    medication: Medication
+
+
+# JSON schema the OpenAI response is constrained to, generated from the models above
+DISEASE_SCHEMA = DiseaseInfo.model_json_schema()
 
 
 # Function to extract the numerical value from a percentage string
 def extract_number(value):
+    number, percent, _ = value.strip().partition('%')
+    if not percent or not number.replace('.', '', 1).isdigit():
+        return None
+    try:
+        return float(number)
+    except ValueError:  # isdigit() also accepts non-decimal digits such as '²'
+        return None
+
+
+# Function to normalize a disease name so that trivial typing variants share a cache entry:
+# case, punctuation and repeated whitespace are ignored ("Crohn's  Disease" -> "crohns disease")
+def normalize_name(name):
+    name = "".join(char for char in name.lower() if char.isalnum() or char.isspace())
+    return " ".join(name.split())
+
+
+# Function to build the disk cache key of a normalized disease name
+def cache_key(normalized_name):
+    return hashlib.sha256(normalized_name.encode()).hexdigest()
 
-    percentage_pattern = r'(\d+(\.\d+)?)%'
-    match = re.match(percentage_pattern, value.strip())
-    if match:
-        return float(match.group(1))
-    else:
+
+# Function to compute the unit-length embeddings of several disease names in one request
+def get_embeddings(texts):
+    response = get_client().embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    embeddings = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+# Function to compute the unit-length embedding of a disease name
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+
+# Function to read and validate a cached response; stale entries are evicted and treated as a miss
+def load_cached_response(key):
+    content = disease_cache.get(key)
+    if content is None:
+        return None
+    try:
+        return DiseaseInfo.model_validate_json(content)
+    except (ValidationError, TypeError):
+        logging.warning(f"Evicting cached response {key} that no longer matches the disease schema")
+        evict_response(key)
         return None
 
 
-# Cached function to query OpenAI and retrieve structured information about a disease
-@st.cache_data(show_spinner=False)
-def get_disease_info(name):
-    # Load template that defines the expected format of the response
-    disease_template = read_file('./disease_response_template.json')
+# Function to remove a cached response together with its row in the embedding index
+def evict_response(key):
+    with disease_cache.transact():
+        disease_cache.delete(key)
+        names, keys, embeddings = disease_cache.get(EMBEDDING_INDEX_KEY, ([], [], None))
+        rows = [idx for idx, row_key in enumerate(keys) if row_key != key]
+        if len(rows) == len(keys):
+            return
+        if rows:
+            disease_cache[EMBEDDING_INDEX_KEY] = ([names[idx] for idx in rows], [keys[idx] for idx in rows],
+                                                  embeddings[rows])
+        else:
+            disease_cache.delete(EMBEDDING_INDEX_KEY)
+
+
+# Function to look up a cached response for a semantically similar disease name. Similar names are
+# not necessarily the same disease ("hepatitis a" vs "hepatitis b"), so a match is only accepted when
+# the cached response is itself named after the queried disease (e.g. "influenza" answered under "flu")
+def find_similar_response(normalized_name, embedding):
+    names, keys, embeddings = disease_cache.get(EMBEDDING_INDEX_KEY, ([], [], None))
+    if embeddings is None:
+        return None
 
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[
+    # Embeddings are stored unit-length, so the dot product is the cosine similarity
+    similarities = embeddings @ embedding
+    for idx in np.argsort(similarities)[::-1]:
+        if similarities[idx] < SIMILARITY_THRESHOLD:
+            break
+        info = load_cached_response(keys[idx])
+        if info is None:
+            continue
+        if normalize_name(info.name) != normalized_name:
+            logging.info(f"Ignoring semantic match '{names[idx]}' ({info.name}) for '{normalized_name}'")
+            continue
+        logging.info(f"Semantic cache hit on '{names[idx]}' (similarity {similarities[idx]:.3f})")
+        return info
+    return None
+
+
+# Function to persist a validated response, as raw JSON bytes, together with the embedding of its disease name
+def store_response(normalized_name, embedding, content):
+    key = cache_key(normalized_name)
+    with disease_cache.transact():
+        disease_cache[key] = content
+        names, keys, embeddings = disease_cache.get(EMBEDDING_INDEX_KEY, ([], [], None))
+        if key in keys:  # Re-fetched name: refresh its row instead of adding a duplicate
+            embeddings = embeddings.copy()
+            embeddings[keys.index(key)] = embedding
+            disease_cache[EMBEDDING_INDEX_KEY] = (names, keys, embeddings)
+            return
+        if embeddings is None:
+            embeddings = embedding[np.newaxis, :]
+        else:
+            embeddings = np.vstack([embeddings, embedding])
+        disease_cache[EMBEDDING_INDEX_KEY] = (names + [normalized_name], keys + [key], embeddings)
+
+
+# Function to build the chat completion request for a disease, shared by streaming and batch queries
+def build_completion_request(name):
+    return {
+        "model": CHAT_MODEL,
+        "response_format": {"type": "json_schema", "json_schema": {"name": "disease", "schema": DISEASE_SCHEMA}},
+        "messages": [
             {"role": "system",
-             "content": f"Please provide information on the following aspects for {name}: 1. Key Statistics, 2. Recovery Options, 3. Recommended Medications. Format the response in JSON with keys for 'name', 'statistics', 'total_cases' (this always has to be a number), 'recovery_rate' (this always has to be a percentage), 'mortality_rate' (this always has to be a percentage) 'recovery_options', (explain each recovery option in detail), and 'medication', (give some side effect examples and dosages).Also this is a json template that you MUST respect {disease_template}. Finally the response should be in json format and not in markdown"}
-        ]
-    )
-    content = response.choices[0].message.content
+             "content": f"Provide key statistics, recovery options, and medications for {name}."}
+        ],
+    }
+
+
+# Generator that streams the OpenAI completion for a disease chunk by chunk
+def stream_disease_info(name):
+    stream = get_client().chat.completions.create(**build_completion_request(name), stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+# Function to render a streamed response as it arrives and return the full content
+def render_stream(chunks):
+    placeholder = st.empty()
+    content = ""
+    for chunk in chunks:
+        content += chunk
+        placeholder.code(content, language="json")
+    placeholder.empty()  # The structured view replaces the raw stream once complete
     return content
 
 
-# Function to display detailed information about a disease
-def display_disease_info(disease):
+# Function to retrieve structured information about a disease, from the cache or from OpenAI
+def get_disease_info(name):
+    normalized_name = normalize_name(name)
+    if not normalized_name:  # Only punctuation or whitespace, nothing to look up
+        return None
+    key = cache_key(normalized_name)
+
+    # Exact match on the normalized name
+    info = load_cached_response(key)
+    if info is not None:
+        return info
+
+    # Semantic match against previously answered diseases
+    embedding = get_embedding(normalized_name)
+    info = find_similar_response(normalized_name, embedding)
+    if info is not None:
+        return info
+
+    # Validate once here so a malformed response fails before any tab is rendered
+    content = render_stream(stream_disease_info(name)).encode()
     try:
-        info = json.loads(disease)
+        info = DiseaseInfo.model_validate_json(content)
+    except ValidationError as e:
+        logging.error(f"OpenAI response for '{name}' does not match the disease schema: {e}")
+        return None
+    store_response(normalized_name, embedding, content)
+    return info
+
+
+# Function to query many diseases at once through the OpenAI Batch API and populate the cache
+def get_disease_info_batch(names):
+    # The normalized name is only the custom_id and cache key; the prompt uses the name as given,
+    # since normalization drops punctuation the model needs ("HIV/AIDS" -> "hivaids")
+    pending = {}
+    for name in names:
+        normalized_name = normalize_name(name)
+        if normalized_name and normalized_name not in pending and load_cached_response(cache_key(normalized_name)) is None:
+            pending[normalized_name] = name
+
+    if pending:
+        client = get_client()
+        lines = [
+            json.dumps({"custom_id": normalized_name, "method": "POST", "url": "/v1/chat/completions",
+                        "body": build_completion_request(name)})
+            for normalized_name, name in pending.items()
+        ]
+        batch_file = client.files.create(file=("diseases.jsonl", "\n".join(lines).encode()), purpose="batch")
+        batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                      completion_window="24h")
+        logging.info(f"Submitted batch {batch.id} for {len(pending)} diseases")
+
+        # Wait until the batch reaches a terminal state
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(BATCH_POLL_INTERVAL)
+            batch = client.batches.retrieve(batch.id)
+
+        if batch.status != "completed" or batch.output_file_id is None:
+            logging.error(f"Batch {batch.id} finished with status '{batch.status}'")
+        else:
+            results = {}
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                result = json.loads(line)
+                if result["error"] or result["response"]["status_code"] != 200:
+                    logging.warning(f"Batch request for '{result['custom_id']}' failed")
+                    continue
+                choice = result["response"]["body"]["choices"][0]
+                # Refusals come back with null content, truncated responses with finish_reason 'length'
+                if choice["message"]["content"] is None or choice["finish_reason"] != "stop":
+                    logging.warning(f"Batch response for '{result['custom_id']}' is incomplete "
+                                    f"(finish_reason '{choice['finish_reason']}', "
+                                    f"refusal {choice['message'].get('refusal')!r})")
+                    continue
+                content = choice["message"]["content"].encode()
+                try:
+                    DiseaseInfo.model_validate_json(content)
+                except ValidationError:
+                    logging.warning(f"Batch response for '{result['custom_id']}' does not match the disease schema")
+                    continue
+                results[result["custom_id"]] = content
+
+            if results:
+                embeddings = get_embeddings(list(results))
+                for (name, content), embedding in zip(results.items(), embeddings):
+                    store_response(name, embedding, content)
+
+    return {name: load_cached_response(cache_key(normalize_name(name))) for name in names}
 
-        # Extract recovery and mortality rates for display
-        recovery_rate = extract_number(info['statistics']["recovery_rate"])
-        mortality_rate = extract_number(info['statistics']["mortality_rate"])
 
-        # Define which tabs to display based on available information
-        tabs = []
-        if recovery_rate is not None and mortality_rate is not None:
-            tabs.append("Statistics")
-        tabs.append("Recovery")
-        tabs.append("Medication")
+# Function to display detailed information about a disease
+def display_disease_info(info):
+    # Extract recovery and mortality rates for display
+    recovery_rate = extract_number(info.statistics.recovery_rate)
+    mortality_rate = extract_number(info.statistics.mortality_rate)
 
-        # Dynamically create the tabs in the Streamlit UI
-        tab_objects = st.tabs(tabs)
+    # Define which tabs to display based on available information, each with its renderer
+    renderers = []
+    if recovery_rate is not None and mortality_rate is not None:
+        renderers.append(("Statistics",
+                          lambda: display_statistics(recovery=recovery_rate, mortality=mortality_rate, name=info.name)))
+    renderers.append(("Recovery", lambda: display_recovery_options(info.recovery_options)))
+    renderers.append(("Medication", lambda: display_medication(info.medication)))
 
-        # Display content based on selected tab
-        for idx, tab_name in enumerate(tabs):
-            with tab_objects[idx]:  # Match tab with content
-                if tab_name == "Statistics":
-                    display_statistics(recovery=recovery_rate, mortality=mortality_rate, name=info['name'])
-                elif tab_name == "Recovery":
-                    display_recovery_options(info['recovery_options'])
-                elif tab_name == "Medication":
-                    display_medication(info['medication'])
+    # Dynamically create the tabs in the Streamlit UI
+    tab_objects = st.tabs([tab_name for tab_name, _ in renderers])
 
-    except json.JSONDecodeError:
-        st.error("Failed to decode the response into JSON. Please check the format of the OpenAI response.")
+    # Display each tab's content
+    for tab, (_, render) in zip(tab_objects, renderers):
+        with tab:
+            render()
 
 
 # Function to display medication details
 def display_medication(medication):
 
-    st.subheader(f"{medication['name']}")
+    st.subheader(f"{medication.name}")
 
     # Display side effects in a bullet point format
     st.write("#### Side Effects")
-    st.markdown("\n".join([f"- {effect}" for effect in medication['side_effects']]))
+    st.markdown("\n".join(f"- {effect}" for effect in medication.side_effects))
 
     # Display dosage information
     st.write("#### Dosage")
-    st.write(medication['dosage'])
+    st.write(medication.dosage)
 
     st.write("---")  # Add a divider
 
@@ -104,23 +333,21 @@ def display_recovery_options(recovery_options):
 
 # Function to display statistics using a bar chart
 def display_statistics(recovery, mortality, name):
-    # Create a DataFrame for the chart data
-    chart_data = pd.DataFrame(
-        {
-            "Recovery Rate": [recovery],
-            "Mortality Rate": [mortality],
-        },
-        index=["Rate"]
-    )
+    # Chart data as plain columns, one bar per rate, labelled "Rate" on the x-axis
+    chart_data = {
+        "Rate": ["Rate"],
+        "Recovery Rate": [recovery],
+        "Mortality Rate": [mortality],
+    }
 
     st.write(f"## Statistics for {name}")
-    st.bar_chart(chart_data) # Display the bar chart
+    st.bar_chart(chart_data, x="Rate") # Display the bar chart
 
 
 # Dialog to display JSON data in a Streamlit modal
 @st.dialog("OpenAI response", width="large")
 def display_json(data):
-    st.json(data)   # Display JSON data in a formatted way
+    st.json(data, expanded=False)   # Display JSON data collapsed; nodes expand on click
 
 
 # Function to show OpenAI response when a button is clicked
@@ -134,18 +361,26 @@ def show_openai_response(openai_response):
 def main():
     st.title("Disease Information Dashboard")
 
-    # Input field for the user to enter the disease name
-    disease_name = st.text_input("Enter the name of the disease:")
-    disease_info = None
-
-    if disease_name:
-        # Show a spinner while fetching the disease data
-        with st.spinner(f"Fetching disease information for '{disease_name}' from OpenAI..."):
-            disease_info = get_disease_info(disease_name)
+    # Input field for the user to enter the disease name, only submitted on an explicit search
+    with st.form("disease_form", clear_on_submit=False):
+        query = st.text_input("Enter the name of the disease:")
+        submitted = st.form_submit_button("Search")
+
+    # Fetch only on submit and remember the result, so later reruns (e.g. opening the response
+    # dialog) redisplay it without any cache lookup or API call
+    if submitted:
+        st.session_state["disease_name"] = query
+        st.session_state["disease_info"] = None
+        if query:
+            # Show a spinner while fetching the disease data
+            with st.spinner(f"Fetching disease information for '{query}' from OpenAI..."):
+                st.session_state["disease_info"] = get_disease_info(query)
+    disease_name = st.session_state.get("disease_name")
+    disease_info = st.session_state.get("disease_info")
 
     if disease_info:
         # Display the raw OpenAI response
-        show_openai_response(disease_info)
+        show_openai_response(disease_info.model_dump())
         st.divider()
 
         # Display detailed disease information
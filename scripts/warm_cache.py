@@ -0,0 +1,41 @@
+# Pre-populates the disease response cache with commonly searched diseases through the OpenAI Batch API,
+# so first visits are served from the cache. Run after each deploy: python scripts/warm_cache.py
+import os
+import sys
+import logging
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app resolves its cache directory and secrets relative to the repository root
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from healthcare_disease_analysis import get_disease_info_batch  # noqa: E402
+
+COMMON_DISEASES = [
+    "Influenza", "COVID-19", "Common cold", "Diabetes", "Hypertension",
+    "Asthma", "Pneumonia", "Bronchitis", "Tuberculosis", "Malaria",
+    "HIV/AIDS", "Hepatitis B", "Hepatitis C", "Measles", "Chickenpox",
+    "Shingles", "Strep throat", "Urinary tract infection", "Migraine", "Epilepsy",
+    "Alzheimer's disease", "Parkinson's disease", "Multiple sclerosis", "Stroke", "Coronary artery disease",
+    "Heart failure", "Atrial fibrillation", "Chronic obstructive pulmonary disease", "Chronic kidney disease", "Anemia",
+    "Hypothyroidism", "Hyperthyroidism", "Rheumatoid arthritis", "Osteoarthritis", "Osteoporosis",
+    "Psoriasis", "Eczema", "Lupus", "Crohn's disease", "Ulcerative colitis",
+    "Irritable bowel syndrome", "Gastroesophageal reflux disease", "Celiac disease", "Depression", "Anxiety disorder",
+    "Breast cancer", "Lung cancer", "Prostate cancer", "Colorectal cancer", "Skin cancer",
+]
+
+
+# Main function to warm the cache
+def main():
+    results = get_disease_info_batch(COMMON_DISEASES)
+    missing = [name for name, info in results.items() if info is None]
+    logging.info(f"Cached {len(results) - len(missing)} of {len(results)} diseases")
+    if missing:
+        logging.warning(f"No cached response for: {', '.join(missing)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())